@@ -1,68 +1,233 @@
 import pandas as pd
+import numpy as np
 from prophet import Prophet
+from statsforecast.models import AutoETS
 import os
+import hashlib
 import joblib
-from datetime import datetime, timedelta
+import threading
+from collections import OrderedDict
+from _kernels import linear_forecast
+
+# Below this many days of history a full model fit isn't worth it; use the linear fallback
+MIN_MODEL_HISTORY = 60
+
+# "ets" (statsforecast AutoETS, default) or "prophet"; kept switchable for A/B validation
+FORECAST_BACKEND = os.getenv("FORECAST_BACKEND", "ets").lower()
+
+# AutoETS interval level, matching Prophet's default interval_width of 0.80
+ETS_LEVEL = 80
+
+# Weekly season offered to AutoETS; its model selection decides whether to use it
+ETS_SEASON_LENGTH = 7
+
+# Prophet's default Monte-Carlo draws for yhat_lower/upper; 0 skips the simulation
+PROPHET_UNCERTAINTY_SAMPLES = 1000
+
+# Disk cache of fitted models is pruned back to this size in the background
+DISK_CACHE_BYTES_LIMIT = 500_000_000
+DISK_CACHE_PRUNE_INTERVAL = 600 # seconds
+
+def _fit_model(ds_bytes: bytes, y_bytes: bytes, yearly_seasonality: bool, backend: str):
+    """
+    Fit a model from the raw ['ds', 'y'] column buffers. Arguments are plain bytes
+    so joblib.Memory can content-address the result on disk.
+    """
+    historical_data = pd.DataFrame({
+        'ds': np.frombuffer(ds_bytes, dtype='datetime64[ns]'),
+        'y': np.frombuffer(y_bytes, dtype=np.float64)
+    })
+    if backend == "prophet":
+        # Initialize and fit Prophet model
+        m = Prophet(
+            daily_seasonality=False, 
+            weekly_seasonality=True, 
+            yearly_seasonality=yearly_seasonality
+        )
+        m.fit(historical_data)
+        return m
+
+    y = historical_data['y'].to_numpy(dtype=np.float64)
+    m = AutoETS(season_length=ETS_SEASON_LENGTH)
+    m.fit(y)
+    return m, historical_data['ds'].iloc[-1]
 
 class CashFlowForecaster:
-    def __init__(self, model_dir='models'):
+    def __init__(self, model_dir=os.path.join(os.path.dirname(__file__), 'models'), cache_size=128, backend=FORECAST_BACKEND):
         self.model_dir = model_dir
+        self.backend = backend
         if not os.path.exists(self.model_dir):
             os.makedirs(self.model_dir)
 
-    def forecast(self, historical_data: pd.DataFrame, days: int = 30):
+        # LRU of fitted models: (business_id, series_hash, ...) -> (model, forecast_df, days)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        # forecast() is called from worker threads; guard the cache, not the fit
+        self._cache_lock = threading.Lock()
+
+        # Fits persist across restarts and workers, keyed by the input bytes
+        self._memory = joblib.Memory(os.path.join(self.model_dir, 'forecast_cache'), verbose=0)
+        self._fit = self._memory.cache(_fit_model)
+        self._prune_stop = threading.Event()
+        self._prune_thread = None
+
+    def start_cache_pruning(self, interval: float = DISK_CACHE_PRUNE_INTERVAL):
+        """
+        Prune the disk cache now and then every `interval` seconds on a daemon
+        thread, keeping the directory walk off the request path.
+        """
+        if self._prune_thread is not None:
+            return
+        self._prune_stop.clear()
+        self._prune_thread = threading.Thread(target=self._prune_loop, args=(interval,), daemon=True)
+        self._prune_thread.start()
+
+    def stop_cache_pruning(self):
+        if self._prune_thread is None:
+            return
+        self._prune_stop.set()
+        self._prune_thread.join()
+        self._prune_thread = None
+
+    def _prune_loop(self, interval: float):
+        while True:
+            try:
+                self._memory.reduce_size(bytes_limit=DISK_CACHE_BYTES_LIMIT)
+            except Exception as e:
+                print(f"Forecast cache pruning failed: {e}")
+            if self._prune_stop.wait(interval):
+                return
+
+    def _store(self, key, entry):
+        with self._cache_lock:
+            self._cache[key] = entry
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def forecast(self, historical_data: pd.DataFrame, days: int = 30, business_id: str = None, with_intervals: bool = True):
         """
         historical_data: DataFrame with ['ds', 'y'] where 'ds' is date and 'y' is amount
+        business_id: optional cache namespace; fitted models are reused while the series is unchanged
+        with_intervals: when False, skip uncertainty estimation; yhat_lower/upper are set to yhat
+
+        Every path forecasts daily totals: transactions are summed per calendar day,
+        with days without transactions as 0.
         """
+        historical_data = (
+            historical_data.set_index('ds')['y'].resample('D').sum()
+            .rename_axis('ds').reset_index()
+        )
+        if len(historical_data) < MIN_MODEL_HISTORY:
+            return self._generate_fallback_forecast(historical_data, days, with_intervals)
+
         # Adaptive Seasonality based on data span
         data_span_days = (historical_data['ds'].max() - historical_data['ds'].min()).days
         yearly_seasonality = data_span_days > 365
-        
-        # Initialize and fit Prophet model
-        m = Prophet(
-            daily_seasonality=False, 
-            weekly_seasonality=True, 
-            yearly_seasonality=yearly_seasonality
-        )
-        m.fit(historical_data)
 
-        # Create future dataframe
-        future = m.make_future_dataframe(periods=days)
-        forecast = m.predict(future)
+        # Content hash of the ['ds', 'y'] columns, so any change in history invalidates the cache
+        ds_bytes = historical_data['ds'].to_numpy(dtype='datetime64[ns]').tobytes()
+        y_bytes = historical_data['y'].to_numpy(dtype=np.float64).tobytes()
+        series_hash = hashlib.blake2b(ds_bytes + y_bytes, digest_size=16).hexdigest()
+
+        key = (business_id, series_hash, yearly_seasonality, self.backend, with_intervals)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+
+        if cached is not None:
+            m, tail, cached_days = cached
+            if cached_days != days:
+                # Same fit, different horizon: only re-run the (cheap) predict step
+                tail = self._predict(m, days, with_intervals)
+                self._store(key, (m, tail, days))
+        else:
+            m = self._fit(ds_bytes, y_bytes, yearly_seasonality, self.backend)
+            tail = self._predict(m, days, with_intervals)
+            self._store(key, (m, tail, days))
 
         # Extract projected growth trend
-        # Compare last actual to last forecast
-        first_yhat = forecast['yhat'].iloc[len(historical_data)]
-        last_yhat = forecast['yhat'].iloc[-1]
+        # Compare first forecast day to last forecast day
+        first_yhat = tail['yhat'].iloc[0]
+        last_yhat = tail['yhat'].iloc[-1]
         trend_percentage = ((last_yhat - first_yhat) / (first_yhat + 1e-6)) * 100
-
-        # Extract the future predictions
-        tail = forecast.tail(days)
         
         return {
-            "predictions": tail[['ds', 'yhat', 'yhat_lower', 'yhat_upper']].to_dict('records'),
-            "trend_percentage": round(trend_percentage, 2),
-            "seasonality_mode": "yearly" if yearly_seasonality else "weekly"
+            "predictions": self._to_columns(tail),
+            "trend_percentage": round(float(trend_percentage), 2),
+            "seasonality_mode": self._seasonality_mode(m, yearly_seasonality)
+        }
+
+    def _seasonality_mode(self, m, yearly_seasonality: bool) -> str:
+        if self.backend == "prophet":
+            return "yearly" if yearly_seasonality else "weekly"
+        # Report what AutoETS selected, e.g. ETS(A,N,A) is weekly, ETS(A,N,N) is none
+        model, _ = m
+        seasonal = model.model_['method'].strip(')').split(',')[-1]
+        return "none" if seasonal == "N" else "weekly"
+
+    @staticmethod
+    def _to_columns(forecast: pd.DataFrame):
+        """
+        Columnar payload: date strings plus float64 arrays, serialized directly by orjson
+        """
+        return {
+            "ds": forecast['ds'].dt.strftime('%Y-%m-%d').tolist(),
+            "yhat": forecast['yhat'].to_numpy(dtype=np.float64),
+            "yhat_lower": forecast['yhat_lower'].to_numpy(dtype=np.float64),
+            "yhat_upper": forecast['yhat_upper'].to_numpy(dtype=np.float64)
         }
 
-    def _generate_fallback_forecast(self, days: int):
+    def _predict(self, m, days: int, with_intervals: bool = True) -> pd.DataFrame:
+        """
+        Future-only frame with ['ds', 'yhat', 'yhat_lower', 'yhat_upper']
+        """
+        if self.backend == "prophet":
+            # Only used at predict time, so one cached fit serves both modes
+            m.uncertainty_samples = PROPHET_UNCERTAINTY_SAMPLES if with_intervals else 0
+            future = m.make_future_dataframe(periods=days, include_history=False)
+            forecast = m.predict(future)
+            if not with_intervals:
+                forecast = forecast.assign(yhat_lower=forecast['yhat'], yhat_upper=forecast['yhat'])
+            return forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
+
+        model, last_ds = m
+        if with_intervals:
+            fc = model.predict(h=days, level=[ETS_LEVEL])
+            lower, upper = fc[f'lo-{ETS_LEVEL}'], fc[f'hi-{ETS_LEVEL}']
+        else:
+            fc = model.predict(h=days)
+            lower = upper = fc['mean']
+        return pd.DataFrame({
+            "ds": pd.date_range(last_ds + pd.Timedelta(days=1), periods=days, freq='D'),
+            "yhat": fc['mean'],
+            "yhat_lower": lower,
+            "yhat_upper": upper
+        })
+
+    def _generate_fallback_forecast(self, historical_data: pd.DataFrame, days: int, with_intervals: bool = True):
         """
         Generates a basic linear forecast if not enough data exists
         """
-        start_date = datetime.now()
-        forecast = []
-        for i in range(1, days + 1):
-            target_date = start_date + timedelta(days=i)
-            forecast.append({
-                "ds": target_date.strftime('%Y-%m-%d'),
-                "yhat": 1000.0,
-                "yhat_lower": 800.0,
-                "yhat_upper": 1200.0
-            })
+        ds_ordinal = historical_data['ds'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+        y = historical_data['y'].to_numpy(dtype=np.float64)
+        yhat, yhat_lower, yhat_upper = linear_forecast(ds_ordinal, y, days)
+        if not with_intervals:
+            yhat_lower = yhat_upper = yhat
+
+        future_ds = (ds_ordinal.max() + np.arange(1, days + 1)).astype('datetime64[D]')
+        forecast = pd.DataFrame({
+            "ds": pd.to_datetime(future_ds),
+            "yhat": yhat,
+            "yhat_lower": yhat_lower,
+            "yhat_upper": yhat_upper
+        })
+        trend_percentage = ((yhat[-1] - yhat[0]) / (yhat[0] + 1e-6)) * 100 if days else 0.0
         return {
-            "predictions": forecast,
-            "trend_percentage": 0.0,
-            "seasonality_mode": "fallback"
+            "predictions": self._to_columns(forecast),
+            "trend_percentage": round(float(trend_percentage), 2),
+            "seasonality_mode": "linear"
         }
 
 # Singleton instance
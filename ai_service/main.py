@@ -1,29 +1,195 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Literal, Optional
 import pandas as pd
+import numpy as np
 import os
+import asyncio
 from datetime import datetime
 from dotenv import load_dotenv
-import joblib
+import json
+from sklearn.feature_extraction.text import HashingVectorizer
 from forecaster import forecaster
+from _kernels import rolling_zscore_spikes
 
 load_dotenv()
 
-app = FastAPI(title="BizTrack AI Service", version="1.0.0")
+app = FastAPI(title="BizTrack AI Service", version="1.0.0", default_response_class=ORJSONResponse)
+
+class HashingNB:
+    """
+    Multinomial Naive Bayes over hashed n-grams, loaded from the raw arrays
+    written by train_categorizer.py. Prediction is one sparse @ dense product.
+    """
+    def __init__(self, model_dir: str):
+        with open(os.path.join(model_dir, 'categorizer_vectorizer.json')) as f:
+            params = json.load(f)
+        params['ngram_range'] = tuple(params['ngram_range'])
+        self.vectorizer = HashingVectorizer(**params)
+        self.feature_log_prob = np.load(os.path.join(model_dir, 'categorizer_feature_log_prob.npy'), mmap_mode='r')
+        self.class_log_prior = np.load(os.path.join(model_dir, 'categorizer_class_log_prior.npy'))
+        self.classes_ = np.load(os.path.join(model_dir, 'categorizer_classes.npy'))
+
+    def _joint_log_likelihood(self, descriptions):
+        X = self.vectorizer.transform(descriptions)
+        return np.asarray(X @ self.feature_log_prob.T) + self.class_log_prior
+
+    def predict(self, descriptions):
+        return self.classes_[self._joint_log_likelihood(descriptions).argmax(axis=1)]
+
+    def predict_log_proba(self, descriptions):
+        jll = self._joint_log_likelihood(descriptions)
+        jll -= jll.max(axis=1, keepdims=True)
+        return jll - np.log(np.exp(jll).sum(axis=1, keepdims=True))
+
+    def predict_proba(self, descriptions):
+        return np.exp(self.predict_log_proba(descriptions))
+
+    def predict_with_confidence(self, descriptions):
+        """
+        One vectorizer pass yields both the label and its confidence
+        """
+        log_probs = self.predict_log_proba(descriptions)
+        best = log_probs.argmax(axis=1)
+        return self.classes_[best], np.exp(log_probs[np.arange(len(best)), best])
+
+class CategorizerBatcher:
+    """
+    Micro-batches concurrent /predict/category requests: requests arriving within
+    `window` seconds (up to `max_batch` of them) share one vectorize + predict call.
+    """
+    def __init__(self, model: HashingNB, max_batch: int = 64, window: float = 0.005):
+        self.model = model
+        self.max_batch = max_batch
+        self.window = window
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def predict(self, descriptions: List[str]):
+        if not descriptions:
+            return self.model.classes_[:0], np.empty(0)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((descriptions, future))
+        return await future
+
+    def _call(self, descriptions: List[str]):
+        """
+        Run the model, returning (result, error) instead of raising: asyncio can't
+        propagate some exceptions (e.g. StopIteration) through the to_thread Future,
+        which would leave the batch unresolved.
+        """
+        try:
+            return self.model.predict_with_confidence(descriptions), None
+        except Exception as e:
+            if isinstance(e, StopIteration):
+                error = RuntimeError(f"Categorizer failed: {e!r}")
+                error.__cause__ = e
+                return None, error
+            return None, e
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._process(batch)
+            except Exception as e:
+                # Never leave a caller waiting on a future nobody will resolve
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError(f"Categorizer batch failed: {e!r}"))
+
+    async def _process(self, batch):
+        descriptions = [d for descs, _ in batch for d in descs]
+        if not descriptions:
+            for descs, future in batch:
+                if not future.done():
+                    future.set_result((self.model.classes_[:0], np.empty(0)))
+            return
+
+        result, error = await asyncio.to_thread(self._call, descriptions)
+        if error is not None:
+            # Re-run each request alone so only the offending one sees the error
+            for descs, future in batch:
+                result, error = await asyncio.to_thread(self._call, descs)
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            return
+
+        # Split the batched result back into per-request slices
+        labels, confidences = result
+        offset = 0
+        for descs, future in batch:
+            end = offset + len(descs)
+            if not future.done():
+                future.set_result((labels[offset:end], confidences[offset:end]))
+            offset = end
 
 # Global variables for models
-MODEL_PATH = os.path.join(os.path.dirname(__file__), 'models', 'categorizer.joblib')
+MODEL_DIR = os.path.join(os.path.dirname(__file__), 'models')
 categorizer_model = None
+categorizer_batcher = None
 
 try:
-    if os.path.exists(MODEL_PATH):
-        categorizer_model = joblib.load(MODEL_PATH)
+    if os.path.exists(os.path.join(MODEL_DIR, 'categorizer_vectorizer.json')):
+        categorizer_model = HashingNB(MODEL_DIR)
         print("NLP Categorizer model loaded successfully")
 except Exception as e:
     print(f"Error loading model: {e}")
 
+# Keyword fallback used until the NLP model is trained; whole tokens only, so
+# inflected forms are listed explicitly
+FALLBACK_KEYWORDS = [
+    ("rent", ["rent", "rental", "lease", "office"]),
+    ("salaries", ["salary", "salaries", "wage", "wages", "pay", "payroll", "staff"]),
+    ("stock", ["stock", "restock", "restocking", "inventory", "buy", "purchase", "purchased"]),
+    ("transport", ["uber", "fuel", "transport", "taxi"]),
+    ("utilities", ["electric", "electricity", "water", "bill", "bills", "power"]),
+    ("marketing", ["ad", "ads", "marketing", "facebook", "google", "promo"]),
+]
+# Keyword -> rank in FALLBACK_KEYWORDS; the lowest-ranked match wins
+FALLBACK_KEYWORD_INDEX = {w: rank for rank, (_, words) in enumerate(FALLBACK_KEYWORDS) for w in words}
+FALLBACK_TOKEN_SEPARATORS = str.maketrans("-/", "  ")
+
+def _fallback_category(description: str) -> str:
+    """
+    Highest-priority category among the description's keyword tokens: one dict lookup per token.
+    """
+    best = len(FALLBACK_KEYWORDS)
+    for token in description.lower().translate(FALLBACK_TOKEN_SEPARATORS).split():
+        rank = FALLBACK_KEYWORD_INDEX.get(token.strip(".,;:!?()&"), best)
+        if rank < best:
+            best = rank
+            if best == 0:
+                break
+    return FALLBACK_KEYWORDS[best][0] if best < len(FALLBACK_KEYWORDS) else "other"
+
 # Enable CORS for the React frontend
 app.add_middleware(
     CORSMiddleware,
@@ -47,11 +213,73 @@ class ForecastRequest(BaseModel):
     income_history: List[Transaction]
     expense_history: List[Transaction]
     days: int = 30
+    with_intervals: bool = False # yhat_lower/upper equal yhat unless requested
 
 class InsightRequest(BaseModel):
     business_id: str
     expense_history: List[Transaction]
 
+def json_body(model):
+    """
+    Validate the raw request bytes with pydantic-core's JSON parser, skipping the
+    intermediate json.loads dicts FastAPI builds for body params. Worth it for the
+    endpoints that accept long transaction histories.
+    """
+    async def dependency(http_request: Request):
+        try:
+            return model.model_validate_json(await http_request.body())
+        except ValidationError as e:
+            raise RequestValidationError([
+                {**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)
+            ])
+    return dependency
+
+def json_body_openapi(model):
+    """
+    Request body docs for endpoints using json_body, which FastAPI can't infer.
+    """
+    schema = model.model_json_schema(ref_template="#/components/schemas/{model}")
+    schema.pop("$defs", None)
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": schema}}}}
+
+@app.on_event("startup")
+def _warmup():
+    """
+    Run each model once with dummy data so JIT compilation and lazy imports
+    happen at boot rather than on the first user request.
+    """
+    try:
+        dummy = pd.DataFrame({
+            'ds': pd.date_range('2024-01-01', periods=90),
+            'y': np.random.default_rng(0).random(90) * 100,
+        })
+        forecaster.forecast(dummy, days=7, business_id="__warmup__")
+        if categorizer_model is not None:
+            categorizer_model.predict_with_confidence(["office rent"])
+        print("AI models warmed up")
+    except Exception as e:
+        print(f"Warmup failed: {e}")
+
+@app.on_event("startup")
+async def _start_batcher():
+    global categorizer_batcher
+    if categorizer_model is not None:
+        categorizer_batcher = CategorizerBatcher(categorizer_model)
+        categorizer_batcher.start()
+
+@app.on_event("shutdown")
+async def _stop_batcher():
+    if categorizer_batcher is not None:
+        await categorizer_batcher.stop()
+
+@app.on_event("startup")
+def _start_cache_pruning():
+    forecaster.start_cache_pruning()
+
+@app.on_event("shutdown")
+def _stop_cache_pruning():
+    forecaster.stop_cache_pruning()
+
 @app.get("/")
 def health_check():
     return {"status": "healthy", "service": "BizTrack AI Engine", "timestamp": datetime.now().isoformat()}
@@ -66,14 +294,7 @@ async def predict_category(request: CategorizationRequest):
     if categorizer_model is None:
         # Fallback to heuristic logic if model isn't trained yet
         for tx in request.transactions:
-            desc = tx.description.lower()
-            category = "other"
-            if any(w in desc for w in ["rent", "lease", "office"]): category = "rent"
-            elif any(w in desc for w in ["salary", "wage", "pay", "staff"]): category = "salaries"
-            elif any(w in desc for w in ["stock", "inventory", "buy", "purchase"]): category = "stock"
-            elif any(w in desc for w in ["uber", "fuel", "transport", "taxi"]): category = "transport"
-            elif any(w in desc for w in ["electric", "water", "bill", "power"]): category = "utilities"
-            elif any(w in desc for w in ["ad", "marketing", "facebook", "google", "promo"]): category = "marketing"
+            category = _fallback_category(tx.description or "")
             
             results.append({
                 "description": tx.description,
@@ -82,90 +303,159 @@ async def predict_category(request: CategorizationRequest):
             })
     else:
         # Use the ML model
-        descriptions = [tx.description for tx in request.transactions]
-        predictions = categorizer_model.predict(descriptions)
-        # MultinomialNB doesnt always provide great probabilities without extra work, 
-        # but we can try predict_proba
-        try:
-            probs = categorizer_model.predict_proba(descriptions)
-            confidences = [float(p.max()) for p in probs]
-        except:
-            confidences = [0.8] * len(predictions)
+        descriptions = [tx.description or "" for tx in request.transactions]
+        if not descriptions:
+            return {"predictions": results}
+        if categorizer_batcher is not None:
+            predictions, confidences = await categorizer_batcher.predict(descriptions)
+        else:
+            predictions, confidences = categorizer_model.predict_with_confidence(descriptions)
 
         for i, tx in enumerate(request.transactions):
             results.append({
                 "description": tx.description,
                 "suggested_category": str(predictions[i]),
-                "confidence": confidences[i]
+                "confidence": float(confidences[i])
             })
         
     return {"predictions": results}
 
-@app.post("/predict/forecast")
-async def predict_forecast(request: ForecastRequest):
+def _txs_to_prophet_df(txs: List[Transaction]) -> pd.DataFrame:
+    """
+    Build Prophet's ['ds', 'y'] frame column-wise, without a per-row dict.
+    Dates are 'YYYY-MM-DD' (Postgres DATE), parsed by numpy rather than pandas' per-row parser.
+    """
+    dates = []
+    amounts = np.empty(len(txs), dtype=np.float64)
+    for i, t in enumerate(txs):
+        dates.append(t.date)
+        amounts[i] = t.amount
+    return pd.DataFrame({
+        'ds': np.array(dates, dtype='datetime64[D]').astype('datetime64[ns]'),
+        'y': amounts,
+    })
+
+EMPTY_FORECAST = {"ds": [], "yhat": [], "yhat_lower": [], "yhat_upper": []}
+
+def _forecast_rows(columns):
+    """
+    Legacy row-per-day payload for ?format=rows callers.
+    """
+    return [
+        {"ds": ds, "yhat": float(y), "yhat_lower": float(lo), "yhat_upper": float(hi)}
+        for ds, y, lo, hi in zip(columns["ds"], columns["yhat"], columns["yhat_lower"], columns["yhat_upper"])
+    ]
+
+def _run_forecast(df: pd.DataFrame, days: int, business_id: str, with_intervals: bool):
+    """
+    Forecast a Prophet frame; empty histories yield an empty forecast.
+    """
+    if df.empty:
+        return {"predictions": EMPTY_FORECAST, "trend_percentage": 0.0, "seasonality_mode": "none"}
+    return forecaster.forecast(df, days=days, business_id=business_id, with_intervals=with_intervals)
+
+@app.post("/predict/forecast", openapi_extra=json_body_openapi(ForecastRequest))
+async def predict_forecast(request: ForecastRequest = Depends(json_body(ForecastRequest)), format: Literal["columns", "rows"] = "columns"):
     """
     Time-Series Forecasting using Facebook Prophet.
+    Forecasts are columnar ({"ds": [...], "yhat": [...], ...}); pass ?format=rows for one dict per day.
     """
     try:
-        # 1. Process Income History
-        income_df = pd.DataFrame([t.dict() for t in request.income_history])
-        if not income_df.empty:
-            income_df['date'] = pd.to_datetime(income_df['date'])
-            income_df = income_df.rename(columns={'date': 'ds', 'amount': 'y'})
-            income_res = forecaster.forecast(income_df, days=request.days)
-        else:
-            income_res = {"predictions": [], "trend_percentage": 0.0, "seasonality_mode": "none"}
-
-        # 2. Process Expense History
-        expense_df = pd.DataFrame([t.dict() for t in request.expense_history])
-        if not expense_df.empty:
-            expense_df['date'] = pd.to_datetime(expense_df['date'])
-            expense_df = expense_df.rename(columns={'date': 'ds', 'amount': 'y'})
-            expense_res = forecaster.forecast(expense_df, days=request.days)
-        else:
-            expense_res = {"predictions": [], "trend_percentage": 0.0, "seasonality_mode": "none"}
+        # Income and expense fits are independent; run them off the event loop in parallel
+        income_df = _txs_to_prophet_df(request.income_history)
+        expense_df = _txs_to_prophet_df(request.expense_history)
+        income_res, expense_res = await asyncio.gather(
+            asyncio.to_thread(_run_forecast, income_df, request.days, request.business_id, request.with_intervals),
+            asyncio.to_thread(_run_forecast, expense_df, request.days, request.business_id, request.with_intervals),
+        )
 
-        return {
+        income_forecast, expense_forecast = income_res["predictions"], expense_res["predictions"]
+        if format == "rows":
+            income_forecast, expense_forecast = _forecast_rows(income_forecast), _forecast_rows(expense_forecast)
+
+        # Returned directly so orjson serializes the numpy columns without jsonable_encoder
+        return ORJSONResponse({
             "business_id": request.business_id,
-            "income_forecast": income_res["predictions"],
+            "income_forecast": income_forecast,
             "income_trend": income_res["trend_percentage"],
-            "expense_forecast": expense_res["predictions"],
+            "expense_forecast": expense_forecast,
             "expense_trend": expense_res["trend_percentage"],
             "seasonality": income_res["seasonality_mode"],
             "message": "Advanced forecast generated successfully"
-        }
+        })
     except Exception as e:
         print(f"Forecasting error: {e}")
         return {"error": str(e), "message": "Failed to generate forecast"}
 
-@app.post("/predict/insights")
-async def predict_insights(request: InsightRequest):
+# Monthly spike detection: latest month vs the preceding months' mean/std
+ZSCORE_WINDOW_MONTHS = 3
+ZSCORE_THRESHOLD = 2.0
+ZSCORE_MIN_INCREASE = 1.25 # ignore tiny jumps on near-constant series
+ZSCORE_MIN_REL_STD = 0.1 # std floor as a fraction of the baseline mean
+
+def _spending_anomalies(txs: List[Transaction]) -> list:
     """
-    Anomaly Detection and Optimization Tips.
-    Identify categories with unusual spending spikes.
+    Anomaly insights for transactions that all carry a description
     """
-    try:
-        df = pd.DataFrame([t.dict() for t in request.expense_history])
-        if df.empty:
-            return {"insights": []}
-            
-        # Group by category
-        category_spending = df.groupby('description')['amount'].sum().to_dict() # Simple for now
+    if not txs:
+        return []
+    amounts = np.fromiter((t.amount for t in txs), dtype=np.float64, count=len(txs))
+    categories = pd.Categorical([t.description for t in txs])
+    # .codes is int8 for <128 categories; widen before codes * n_months overflows
+    codes = categories.codes.astype(np.intp)
+    n_categories = len(categories.categories)
         
-        # Real logic: compare last month vs average of previous 3 months
-        # For simplicity in this demo, we'll flag anything over 20% of total
-        total = sum(category_spending.values())
-        insights = []
-        
-        for cat, amt in category_spending.items():
-            if amt > total * 0.3: # Static threshold for demo
+    # Group by category: one bincount over the categorical codes
+    category_spending = np.bincount(codes, weights=amounts, minlength=n_categories) # Simple for now
+    
+    # Real logic: compare last month vs average of previous 3 months
+    # For simplicity in this demo, we'll flag anything over 20% of total
+    total = category_spending.sum()
+    spikes = np.flatnonzero(category_spending > total * 0.3) # Static threshold for demo
+    
+    insights = [{
+        "type": "anomaly",
+        "category": categories.categories[i],
+        "severity": "medium",
+        "message": f"Spending in {categories.categories[i]} is unusually high ({(category_spending[i]/total*100):.1f}% of total).",
+        "action": "Review individual receipts for potential overspending."
+    } for i in spikes]
+    flagged = set(spikes.tolist())
+    
+    # Flag categories whose latest month jumps well above their previous months
+    months = np.array([t.date for t in txs], dtype='datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    month_idx = months - months.min()
+    n_months = int(month_idx.max()) + 1
+    if n_months > 2:
+        monthly = np.bincount(
+            codes * n_months + month_idx, weights=amounts, minlength=n_categories * n_months
+        ).reshape(n_categories, n_months)
+        for i, row in enumerate(monthly):
+            if i in flagged:
+                continue
+            cat = categories.categories[i]
+            z = rolling_zscore_spikes(row, ZSCORE_WINDOW_MONTHS, ZSCORE_MIN_REL_STD)[-1]
+            baseline = row[-1 - ZSCORE_WINDOW_MONTHS:-1].mean()
+            if z > ZSCORE_THRESHOLD and row[-1] > baseline * ZSCORE_MIN_INCREASE:
                 insights.append({
                     "type": "anomaly",
                     "category": cat,
-                    "severity": "medium",
-                    "message": f"Spending in {cat} is unusually high ({(amt/total*100):.1f}% of total).",
-                    "action": "Review individual receipts for potential overspending."
+                    "severity": "high" if z > 2 * ZSCORE_THRESHOLD else "medium",
+                    "message": f"Spending in {cat} this month is {(row[-1] / baseline - 1) * 100:.0f}% above its recent average.",
+                    "action": "Check for one-off or duplicated charges this month."
                 })
+    return insights
+
+@app.post("/predict/insights", openapi_extra=json_body_openapi(InsightRequest))
+async def predict_insights(request: InsightRequest = Depends(json_body(InsightRequest))):
+    """
+    Anomaly Detection and Optimization Tips.
+    Identify categories with unusual spending spikes.
+    """
+    try:
+        if not request.expense_history:
+            return {"insights": []}
+        insights = _spending_anomalies([t for t in request.expense_history if t.description is not None])
         
         if not insights:
             insights.append({
@@ -180,4 +470,5 @@ async def predict_insights(request: InsightRequest):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Each worker is a separate process with its own model cache
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=int(os.getenv("AI_SERVICE_WORKERS", "1")))
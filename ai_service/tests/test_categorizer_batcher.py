@@ -0,0 +1,73 @@
+import asyncio
+import json
+import os
+
+import httpx
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.naive_bayes import MultinomialNB
+
+import main
+
+
+def _write_model(model_dir):
+    params = {'n_features': 2**10, 'ngram_range': [1, 1], 'alternate_sign': False, 'norm': 'l2'}
+    vectorizer = HashingVectorizer(**{**params, 'ngram_range': (1, 1)})
+    clf = MultinomialNB(alpha=0.1).fit(
+        vectorizer.transform(["office rent", "staff salary", "uber ride"]),
+        ["rent", "salaries", "transport"],
+    )
+    with open(os.path.join(model_dir, 'categorizer_vectorizer.json'), 'w') as f:
+        json.dump(params, f)
+    np.save(os.path.join(model_dir, 'categorizer_feature_log_prob.npy'), clf.feature_log_prob_)
+    np.save(os.path.join(model_dir, 'categorizer_class_log_prior.npy'), clf.class_log_prior_)
+    np.save(os.path.join(model_dir, 'categorizer_classes.npy'), clf.classes_)
+
+
+def test_empty_request_does_not_wedge_batcher(tmp_path, monkeypatch):
+    _write_model(tmp_path)
+    model = main.HashingNB(str(tmp_path))
+    monkeypatch.setattr(main, 'categorizer_model', model)
+
+    async def run():
+        batcher = main.CategorizerBatcher(model)
+        monkeypatch.setattr(main, 'categorizer_batcher', batcher)
+        batcher.start()
+        try:
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                empty = await asyncio.wait_for(client.post("/predict/category", json={"transactions": []}), 5)
+                normal = await asyncio.wait_for(client.post("/predict/category", json={
+                    "transactions": [{"description": "office rent", "amount": 100, "date": "2024-01-01"}],
+                }), 5)
+            return empty, normal
+        finally:
+            await batcher.stop()
+
+    empty, normal = asyncio.run(run())
+    assert empty.status_code == 200
+    assert empty.json() == {"predictions": []}
+    assert normal.status_code == 200
+    assert normal.json()["predictions"][0]["suggested_category"] == "rent"
+
+
+def test_batcher_resolves_futures_when_model_raises_stop_iteration(tmp_path):
+    _write_model(tmp_path)
+    model = main.HashingNB(str(tmp_path))
+
+    def broken(descriptions):
+        raise StopIteration
+
+    model.predict_with_confidence = broken
+
+    async def run():
+        batcher = main.CategorizerBatcher(model)
+        batcher.start()
+        try:
+            return await asyncio.wait_for(
+                asyncio.gather(batcher.predict(["office rent"]), return_exceptions=True), 5)
+        finally:
+            await batcher.stop()
+
+    [result] = asyncio.run(run())
+    assert isinstance(result, RuntimeError)
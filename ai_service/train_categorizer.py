@@ -1,9 +1,9 @@
 import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.pipeline import Pipeline
-import joblib
+import json
 import os
 
 # 1. Generate Synthetic Training Data
@@ -50,24 +50,38 @@ data = [
 df = pd.DataFrame(data, columns=['description', 'category'])
 
 # 2. Build NLP Pipeline
-# TfidfVectorizer converts text to numbers
-# MultinomialNB is great for text classification
+# HashingVectorizer is stateless, so there is no vocabulary to persist;
+# only its constructor params are saved and it is rebuilt at load time.
+# alternate_sign=False keeps features non-negative for MultinomialNB.
+vectorizer_params = {
+    "n_features": 2 ** 15,
+    "ngram_range": (1, 2),
+    "stop_words": "english",
+    "alternate_sign": False,
+    "norm": "l2",
+}
 model = Pipeline([
-    ('tfidf', TfidfVectorizer(ngram_range=(1, 2), stop_words='english')),
+    ('hv', HashingVectorizer(**vectorizer_params)),
     ('clf', MultinomialNB(alpha=0.1))
 ])
 
 # 3. Train
 print("Training Smart Categorizer model...")
 model.fit(df['description'], df['category'])
+clf = model.named_steps['clf']
 
 # 4. Save
+# Raw .npy arrays load (and mmap) without unpickling scikit-learn objects
 model_path = os.path.join(os.path.dirname(__file__), 'models')
 if not os.path.exists(model_path):
     os.makedirs(model_path)
 
-joblib.dump(model, os.path.join(model_path, 'categorizer.joblib'))
-print(f"Model saved to {os.path.join(model_path, 'categorizer.joblib')}")
+with open(os.path.join(model_path, 'categorizer_vectorizer.json'), 'w') as f:
+    json.dump(vectorizer_params, f)
+np.save(os.path.join(model_path, 'categorizer_feature_log_prob.npy'), clf.feature_log_prob_)
+np.save(os.path.join(model_path, 'categorizer_class_log_prior.npy'), clf.class_log_prior_)
+np.save(os.path.join(model_path, 'categorizer_classes.npy'), clf.classes_.astype(str))
+print(f"Model saved to {model_path}")
 
 # 5. Quick Test
 test_desc = ["Supplies for the shop"]
@@ -11,6 +11,16 @@ export interface AICategoryPrediction {
     confidence: number;
 }
 
+/**
+ * Columnar forecast series: parallel arrays indexed by day
+ */
+export interface AIForecastSeries {
+    ds: string[];
+    yhat: number[];
+    yhat_lower: number[];
+    yhat_upper: number[];
+}
+
 export const aiService = {
     /**
      * Predict category for a transaction description
@@ -64,6 +74,18 @@ export const aiService = {
         }
     },
 
+    /**
+     * Sum forecast yhat per month ("YYYY-MM")
+     */
+    sumForecastByMonth(series: AIForecastSeries): Map<string, number> {
+        const totals = new Map<string, number>();
+        series.ds.forEach((ds, i) => {
+            const month = ds.slice(0, 7);
+            totals.set(month, (totals.get(month) ?? 0) + series.yhat[i]);
+        });
+        return totals;
+    },
+
     /**
      * Get anomaly detection insights
      */
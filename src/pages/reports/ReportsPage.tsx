@@ -182,17 +182,12 @@ export function ReportsPage() {
 
                         // Group forecast by month to match groupedData
                         const futureData: any[] = [];
-                        const months = new Set<string>();
+                        const incomeByMonth = aiService.sumForecastByMonth(forecast.income_forecast);
+                        const expenseByMonth = aiService.sumForecastByMonth(forecast.expense_forecast);
 
-                        forecast.income_forecast.forEach((f: any) => months.add(f.ds.slice(0, 7)));
-
-                        Array.from(months).sort().forEach(month => {
-                            const inc = forecast.income_forecast
-                                .filter((f: any) => f.ds.startsWith(month))
-                                .reduce((sum: number, f: any) => sum + f.yhat, 0);
-                            const exp = forecast.expense_forecast
-                                .filter((f: any) => f.ds.startsWith(month))
-                                .reduce((sum: number, f: any) => sum + f.yhat, 0);
+                        Array.from(incomeByMonth.keys()).sort().forEach(month => {
+                            const inc = incomeByMonth.get(month) ?? 0;
+                            const exp = expenseByMonth.get(month) ?? 0;
 
                             futureData.push({
                                 name: new Date(month + '-01').toLocaleDateString('en-US', { month: 'short' }),